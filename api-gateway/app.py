@@ -1,11 +1,18 @@
+import hashlib
 import os
 import random
+import threading
+import time
+import httpx
+import orjson
 import requests
-from flask import Flask, request, jsonify
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, TimeoutError as FuturesTimeoutError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask, request, Response
 from flask_cors import CORS
 
 app = Flask(__name__)
-CORS(app)
 
 # --- Configuration ---
 # Get service URLs from environment variables or use defaults for local testing
@@ -15,6 +22,60 @@ LOCATION_SERVICE_URL = os.getenv("LOCATION_SERVICE_URL", "http://127.0.0.1:5001"
 ROUTING_SERVICE_URLS_STR = os.getenv("ROUTING_SERVICE_URLS", "http://127.0.0.1:5002,http://127.0.0.1:5003")
 ROUTING_SERVICE_URLS = [url.strip() for url in ROUTING_SERVICE_URLS_STR.split(',')]
 
+# CORS is only needed when the UI is served from another origin (e.g. index.html opened locally).
+# Behind Nginx the UI and /api/ share an origin, so set CORS_ORIGINS="" there to skip the CORS hooks entirely.
+CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*")
+if CORS_ORIGINS:
+    CORS(app, resources={r"/api/*": {"origins": [origin.strip() for origin in CORS_ORIGINS.split(',')]}}, send_wildcard=True)
+
+# Shared HTTP session for the Location Service so calls reuse pooled keep-alive
+# connections instead of paying a fresh TCP handshake on every request.
+# Only failed connection attempts are retried: read timeouts surface as Timeout right away,
+# and the Location Service's 503/504 fallback responses are used as-is rather than re-requested.
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_maxsize=50,
+    max_retries=Retry(connect=2, read=False, status=0, backoff_factor=0.2)
+)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
+# Persistent client for the Routing Services. With HTTP/2 (negotiated over TLS, e.g. when
+# the routing URLs are https:// behind Nginx) recommendation calls are multiplexed over
+# one connection per instance; plain http:// URLs fall back to HTTP/1.1.
+ROUTING_CLIENT = httpx.Client(
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=2, # Retry failed connection attempts
+        limits=httpx.Limits(max_connections=16, max_keepalive_connections=16)
+    ),
+    timeout=10.0
+)
+
+# Health probes use their own client without transport retries, so a dead instance
+# costs a single short timeout per probe instead of one per attempt.
+HEALTH_CLIENT = httpx.Client(transport=httpx.HTTPTransport(http2=True), timeout=1.5)
+
+# Worker threads for overlapping the location lookup with routing health checks.
+# Health probes get their own small pool (at most one probe per URL runs at a time),
+# so a hanging routing instance can never queue work ahead of location lookups.
+LOCATION_POOL = ThreadPoolExecutor(max_workers=16)
+HEALTH_POOL = ThreadPoolExecutor(max_workers=len(ROUTING_SERVICE_URLS))
+
+# Routing service health is cached for a few seconds and refreshed in the
+# background, so requests normally read the cache instead of probing.
+HEALTH_TTL = 5.0 # seconds
+HEALTH_CACHE = {} # url -> (checked_at, is_healthy)
+HEALTH_PROBES = {} # url -> future of the probe currently running for it
+HEALTH_PROBES_LOCK = threading.Lock()
+
+# Exact framing of a routing service response body (as serialized by orjson)
+RECOMMENDATIONS_PREFIX = b'{"recommendations":['
+RECOMMENDATIONS_SUFFIX = b']}'
+
+# How long browsers/CDNs may reuse an /api/route response (seconds)
+ROUTE_CACHE_MAX_AGE = 60
+
 # Simple Geocoding Simulation (City Name -> Lat/Lon)
 CITY_COORDINATES = {
     "new york": {"latitude": 40.7128, "longitude": -74.0060},
@@ -25,22 +86,85 @@ CITY_COORDINATES = {
     "kolkata": {"latitude": 22.5726, "longitude": 88.3639},
     "mumbai": {"latitude": 19.0760, "longitude": 72.8777},
 }
+# Flattened (latitude, longitude) tuples built once, so lookups don't rebuild dicts
+CITY_COORDINATES_LOWER = {city.casefold(): (coords["latitude"], coords["longitude"]) for city, coords in CITY_COORDINATES.items()}
+
+# Origin used when the Location Service fails completely
+DEFAULT_ORIGIN = {"latitude": 51.5074, "longitude": -0.1278, "city": "London (Default Origin)"}
 
 # --- Helper Functions ---
+def ojsonify(obj, status=200):
+    """Drop-in replacement for jsonify that serializes with orjson."""
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+def extract_recommendations_json(raw):
+    """
+    Returns the routing service's recommendations list as raw JSON bytes, without decoding it.
+    The routing service replies with exactly {"recommendations":[...]}; anything else is parsed.
+    Raises ValueError if the body is not a JSON object.
+    """
+    # Options hold only flat scalars, so the list's closing "]" must be the first one after
+    # the prefix; any earlier "]" (e.g. another array-valued key) sends the body to the parser.
+    if (raw.startswith(RECOMMENDATIONS_PREFIX) and raw.endswith(RECOMMENDATIONS_SUFFIX)
+            and raw.find(b"]", len(RECOMMENDATIONS_PREFIX)) == len(raw) - len(RECOMMENDATIONS_SUFFIX)):
+        return raw[len(RECOMMENDATIONS_PREFIX) - 1:-1]
+    data = orjson.loads(raw) # orjson.JSONDecodeError is a ValueError
+    if not isinstance(data, dict):
+        raise ValueError("Routing service response is not a JSON object")
+    return orjson.dumps(data.get("recommendations", []))
+
 def get_coordinates_for_city(city_name):
-    """Looks up coordinates for a city name (case-insensitive)."""
-    return CITY_COORDINATES.get(city_name.lower())
+    """Looks up (latitude, longitude) for a city name (case-insensitive)."""
+    return CITY_COORDINATES_LOWER.get(city_name.casefold())
 
-def check_service_health(url):
-    """Performs a very basic health check on a service URL."""
+def probe_service_health(url):
+    """Performs a very basic health check on a service URL and caches the result."""
     try:
         # Use the /health endpoint we added to the routing service
         health_url = f"{url.rstrip('/')}/health"
-        response = requests.get(health_url, timeout=1.5) # Short timeout for health check
-        return response.status_code == 200 and response.json().get("status") == "ok"
-    except requests.exceptions.RequestException as e:
+        response = HEALTH_CLIENT.get(health_url) # Short timeout for health check
+        is_healthy = False
+        if response.status_code == 200:
+            data = response.json() # Raises ValueError for a non-JSON body
+            is_healthy = isinstance(data, dict) and data.get("status") == "ok"
+    except (httpx.HTTPError, ValueError) as e:
         print(f"Health check failed for {url}: {e}")
-        return False
+        is_healthy = False
+    HEALTH_CACHE[url] = (time.monotonic(), is_healthy)
+    return is_healthy
+
+def cached_service_health(url):
+    """Returns the cached health of a service URL, or None if the entry is missing or stale."""
+    cached = HEALTH_CACHE.get(url)
+    if cached is not None and time.monotonic() - cached[0] < HEALTH_TTL:
+        return cached[1]
+    return None
+
+def start_health_probe(url):
+    """Returns the in-flight probe for a service URL, starting one only if none is running."""
+    with HEALTH_PROBES_LOCK:
+        future = HEALTH_PROBES.get(url)
+        if future is None or future.done():
+            future = HEALTH_POOL.submit(probe_service_health, url)
+            HEALTH_PROBES[url] = future
+        return future
+
+def mark_service_unhealthy(url):
+    """Demotes a service immediately after a failed call so the next request skips it."""
+    HEALTH_CACHE[url] = (time.monotonic(), False)
+
+def refresh_health_cache():
+    """Background loop that keeps HEALTH_CACHE fresh for every routing service."""
+    while True:
+        try:
+            # Probe all URLs concurrently, reusing any probe a request already started
+            wait([start_health_probe(url) for url in ROUTING_SERVICE_URLS])
+        except Exception as e:
+            # Never let the refresher thread die; requests fall back to probing on demand
+            print(f"API Gateway Error: Health refresh failed: {e}")
+        time.sleep(HEALTH_TTL / 2)
+
+threading.Thread(target=refresh_health_cache, daemon=True).start()
 
 # --- API Routes ---
 @app.route('/api/route', methods=['GET'])
@@ -58,17 +182,24 @@ def get_route_recommendations():
     test_ip = request.args.get('test_ip') # Optional: for overriding IP in location lookup
 
     if not dest_city_name:
-        return jsonify({"error": "Destination city parameter ('destination') is required"}), 400
+        return ojsonify({"error": "Destination city parameter ('destination') is required"}), 400
+
+    # Fire off the location lookup and any needed routing health checks at once so
+    # they run concurrently instead of one after another. Fresh health entries are
+    # read from the cache, so normally no probes are started here.
+    location_params = {}
+    if test_ip:
+        location_params['ip'] = test_ip
+    print(f"API Gateway: Calling Location Service at {LOCATION_SERVICE_URL}")
+    location_future = LOCATION_POOL.submit(SESSION.get, f"{LOCATION_SERVICE_URL}/location", params=location_params, timeout=5)
+    stale_urls = [url for url in ROUTING_SERVICE_URLS if cached_service_health(url) is None]
+    health_futures = {start_health_probe(url): url for url in stale_urls}
 
     # 1. Get Origin Coordinates from Location Service
     origin_coords = None
     location_warning = None
     try:
-        location_params = {}
-        if test_ip:
-            location_params['ip'] = test_ip
-        print(f"API Gateway: Calling Location Service at {LOCATION_SERVICE_URL}")
-        location_resp = requests.get(f"{LOCATION_SERVICE_URL}/location", params=location_params, timeout=5)
+        location_resp = location_future.result()
         location_resp.raise_for_status() # Check for HTTP errors
         origin_data = location_resp.json()
         location_warning = origin_data.get("warning") # Capture warnings (e.g., default used)
@@ -88,20 +219,20 @@ def get_route_recommendations():
 
     except requests.exceptions.Timeout:
         print("API Gateway Error: Request to Location Service timed out.")
-        return jsonify({"error": "Failed to get origin location: Request timed out"}), 504
+        return ojsonify({"error": "Failed to get origin location: Request timed out"}), 504
     except requests.exceptions.RequestException as e:
         print(f"API Gateway Error: Could not connect to Location Service: {e}")
         # Decide if we should proceed with a default origin or fail
         # For now, we let origin_coords remain None and handle it later
         location_warning = f"Could not contact Location Service ({e}). Origin unknown."
         # Optionally return 503 Service Unavailable if origin is critical
-        # return jsonify({"error": f"Could not contact Location Service: {e}"}), 503
+        # return ojsonify({"error": f"Could not contact Location Service: {e}"}), 503
 
     # Handle case where origin couldn't be determined
     if origin_coords is None:
          print("API Gateway: Origin coordinates could not be determined. Using default.")
          # Using a default origin (e.g., London) if location service failed completely
-         origin_coords = {"latitude": 51.5074, "longitude": -0.1278, "city": "London (Default Origin)"}
+         origin_coords = DEFAULT_ORIGIN
          if not location_warning: # Add a warning if none exists yet
              location_warning = "Origin location could not be determined; using default."
 
@@ -109,14 +240,35 @@ def get_route_recommendations():
     # 2. Get Destination Coordinates (Geocoding Simulation)
     dest_coords = get_coordinates_for_city(dest_city_name)
     if not dest_coords:
-        return jsonify({"error": f"Could not find coordinates for destination city: {dest_city_name}"}), 404 # Not Found
+        return ojsonify({"error": f"Could not find coordinates for destination city: {dest_city_name}"}), 404 # Not Found
+
+    # The mock recommendations differ on every call, so the ETag covers the request's
+    # deterministic inputs instead of the body; a revalidation then skips the routing call.
+    # Responses for a test_ip are specific to that caller and stay out of shared caches.
+    # Only an explicit tag counts: tags are issued with 200 responses alone, whereas
+    # "If-None-Match: *" would otherwise turn e.g. an invalid preference into a 304.
+    etag = None
+    if not test_ip:
+        etag_inputs = orjson.dumps([dest_city_name, preference, origin_coords, location_warning])
+        etag = hashlib.blake2b(etag_inputs, digest_size=16).hexdigest()
+        if not request.if_none_match.star_tag and request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.set_etag(etag, weak=True)
+            response.headers["Cache-Control"] = f"public, max-age={ROUTE_CACHE_MAX_AGE}"
+            return response
 
     # 3. Select a Healthy Routing Service (Basic Load Balancing + Health Check)
-    available_routing_services = [url for url in ROUTING_SERVICE_URLS if check_service_health(url)]
+    # Wait (bounded) for any probes started above; a probe that doesn't finish counts as unhealthy
+    try:
+        for future in as_completed(health_futures, timeout=2.0):
+            future.result()
+    except FuturesTimeoutError:
+        print("API Gateway: Timed out waiting for routing service health checks.")
+    available_routing_services = [url for url in ROUTING_SERVICE_URLS if cached_service_health(url)]
 
     if not available_routing_services:
         print("API Gateway Error: No healthy Routing Service instances available.")
-        return jsonify({"error": "Recommendation service is temporarily unavailable"}), 503 # Service Unavailable
+        return ojsonify({"error": "Recommendation service is temporarily unavailable"}), 503 # Service Unavailable
 
     # Randomly choose from the healthy ones
     selected_routing_url = random.choice(available_routing_services)
@@ -127,44 +279,56 @@ def get_route_recommendations():
         routing_params = {
             "origin_lat": origin_coords["latitude"],
             "origin_lon": origin_coords["longitude"],
-            "dest_lat": dest_coords["latitude"],
-            "dest_lon": dest_coords["longitude"],
+            "dest_lat": dest_coords[0],
+            "dest_lon": dest_coords[1],
             "preference": preference
         }
-        routing_resp = requests.get(f"{selected_routing_url}/recommendations", params=routing_params, timeout=10)
+        routing_resp = ROUTING_CLIENT.get(f"{selected_routing_url}/recommendations", params=routing_params)
         routing_resp.raise_for_status() # Check for HTTP errors from routing service
-        recommendations_data = routing_resp.json()
+        recommendations_json = extract_recommendations_json(routing_resp.content)
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         print(f"API Gateway Error: Request to Routing Service ({selected_routing_url}) timed out.")
-        return jsonify({"error": "Fetching recommendations timed out"}), 504
-    except requests.exceptions.RequestException as e:
+        return ojsonify({"error": "Fetching recommendations timed out"}), 504
+    except httpx.HTTPError as e:
         print(f"API Gateway Error: Could not get recommendations from {selected_routing_url}: {e}")
+        if isinstance(e, httpx.TransportError):
+            mark_service_unhealthy(selected_routing_url)
         # Try to return error from downstream service if possible
         error_details = "Unknown error communicating with recommendation service."
         status_code = 503 # Service Unavailable by default
-        if e.response is not None:
+        if isinstance(e, httpx.HTTPStatusError):
             status_code = e.response.status_code
             try:
                 error_details = e.response.json().get("error", error_details)
             except ValueError:
                 error_details = e.response.text[:200] # Limit error text length
-        return jsonify({"error": "Failed to get recommendations", "details": error_details}), status_code
+        return ojsonify({"error": "Failed to get recommendations", "details": error_details}), status_code
+    except ValueError as e:
+        print(f"API Gateway Error: Invalid response from {selected_routing_url}: {e}")
+        return ojsonify({"error": "Failed to get recommendations", "details": "Invalid response from recommendation service."}), 503
 
     # 5. Combine Results and Return
     final_response = {
         "origin": origin_coords,
         "destination_requested": dest_city_name,
-        "destination_coords": dest_coords,
+        "destination_coords": {"latitude": dest_coords[0], "longitude": dest_coords[1]},
         "preference": preference,
-        "recommendations": recommendations_data.get("recommendations", []),
         "notes": []
     }
     if location_warning:
         final_response["notes"].append(location_warning)
 
-    return jsonify(final_response)
+    # Splice the recommendations in as raw JSON instead of decoding and re-encoding them
+    body = orjson.dumps(final_response)[:-1] + b',"recommendations":' + recommendations_json + b"}"
 
+    response = Response(body, mimetype="application/json")
+    if etag is None:
+        response.headers["Cache-Control"] = "private, no-store"
+    else:
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = f"public, max-age={ROUTE_CACHE_MAX_AGE}"
+    return response
 
 if __name__ == '__main__':
     print("Starting API Gateway on http://127.0.0.1:5000")
@@ -0,0 +1,21 @@
+import multiprocessing
+import os
+
+# Shared Gunicorn settings for the backend services (api-gateway, location-service, routing-service).
+# Run from inside a service directory and pass that service's port, e.g.:
+#   gunicorn -c ../gunicorn_conf.py -b 127.0.0.1:5000 app:app
+
+# Worker processes (override with GUNICORN_WORKERS on small VMs)
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+
+# Threaded workers so requests waiting on downstream HTTP calls don't block the whole process
+worker_class = "gthread"
+threads = 8
+
+# Keep connections from Nginx / the API Gateway open between requests
+keepalive = 30
+timeout = 30
+
+# Access logging is off unless GUNICORN_ACCESS_LOG is set (e.g. "-" for stdout); keep the format minimal
+accesslog = os.getenv("GUNICORN_ACCESS_LOG")
+access_log_format = '%(h)s "%(r)s" %(s)s %(M)sms'
@@ -1,6 +1,9 @@
 import os
+import threading
+import orjson
 import requests
-from flask import Flask, jsonify, request
+from cachetools import TTLCache
+from flask import Flask, Response, request
 from dotenv import load_dotenv
 
 # Load environment variables from .env file in the current directory
@@ -12,6 +15,9 @@ app = Flask(__name__)
 IPSTACK_ACCESS_KEY = os.getenv('IPSTACK_API_KEY')
 IPSTACK_BASE_URL = "http://api.ipstack.com/" # Use http for free tier
 
+# Persistent session so repeated IPStack lookups reuse the same keep-alive connection
+SESSION = requests.Session()
+
 # Default location (e.g., New York) to use if API fails or key is missing
 DEFAULT_LOCATION = {
     "latitude": 40.7128,
@@ -21,6 +27,22 @@ DEFAULT_LOCATION = {
     "country_name": "United States"
 }
 
+# Successful IPStack lookups are cached per IP so repeat callers skip the external round-trip.
+# 'check' always resolves to this service's own outbound IP, so it caches as a single entry.
+LOCATION_CACHE_TTL = 3600 # seconds
+LOCATION_CACHE = TTLCache(maxsize=4096, ttl=LOCATION_CACHE_TTL)
+LOCATION_CACHE_LOCK = threading.Lock()
+
+def ojsonify(obj, status=200):
+    """Drop-in replacement for jsonify that serializes with orjson."""
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+def cacheable_location_response(location_info):
+    """Returns a successful lookup with headers that let downstream HTTP caches reuse it."""
+    response = ojsonify(location_info)
+    response.headers["Cache-Control"] = f"public, max-age={LOCATION_CACHE_TTL}"
+    return response
+
 @app.route('/location', methods=['GET'])
 def get_location():
     """
@@ -31,17 +53,22 @@ def get_location():
     if not IPSTACK_ACCESS_KEY:
         print("Warning: IPSTACK_API_KEY not found in environment variables.")
         warning_msg = "Location API key not configured. Returning default location."
-        return jsonify({**DEFAULT_LOCATION, "warning": warning_msg}), 200 # Return 200 but indicate default
+        return ojsonify({**DEFAULT_LOCATION, "warning": warning_msg}), 200 # Return 200 but indicate default
 
     # Use 'check' to get location for the request IP, or use provided 'ip' query param
     # Note: '127.0.0.1' or private IPs often don't resolve well on free tier.
     # 'check' is usually the best option unless testing specific public IPs.
     ip_address = request.args.get('ip', 'check')
 
+    with LOCATION_CACHE_LOCK:
+        cached_info = LOCATION_CACHE.get(ip_address)
+    if cached_info is not None:
+        return cacheable_location_response(cached_info)
+
     try:
         print(f"Location Service: Requesting location for IP: {ip_address}")
         url = f"{IPSTACK_BASE_URL}{ip_address}?access_key={IPSTACK_ACCESS_KEY}&fields=ip,city,region_name,country_name,latitude,longitude"
-        response = requests.get(url, timeout=5) # Add a timeout
+        response = SESSION.get(url, timeout=5) # Add a timeout
         response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
         data = response.json()
 
@@ -50,7 +77,7 @@ def get_location():
             error_info = data.get("error", {}).get("info", "Unknown IPStack API error")
             print(f"IPStack API Error: {error_info}")
             warning_msg = f"Could not fetch location from IPStack ({error_info}). Returning default location."
-            return jsonify({**DEFAULT_LOCATION, "warning": warning_msg}), 200 # Return 200 but indicate default
+            return ojsonify({**DEFAULT_LOCATION, "warning": warning_msg}), 200 # Return 200 but indicate default
 
         # Successfully got data
         location_info = {
@@ -62,17 +89,20 @@ def get_location():
             "longitude": data.get("longitude"),
         }
         print(f"Location Service: Successfully found location: {location_info.get('city')}")
-        return jsonify(location_info)
+        # Only real lookups are cached; default/fallback responses are retried next time
+        with LOCATION_CACHE_LOCK:
+            LOCATION_CACHE[ip_address] = location_info
+        return cacheable_location_response(location_info)
 
     except requests.exceptions.Timeout:
         print("Error: Request to IPStack timed out.")
         warning_msg = "Location service request timed out. Returning default location."
-        return jsonify({**DEFAULT_LOCATION, "warning": warning_msg}), 504 # 504 Gateway Timeout might be suitable
+        return ojsonify({**DEFAULT_LOCATION, "warning": warning_msg}), 504 # 504 Gateway Timeout might be suitable
 
     except requests.exceptions.RequestException as e:
         print(f"Error: Network or HTTP error calling IPStack: {e}")
         warning_msg = f"Network error contacting location service ({e}). Returning default location."
-        return jsonify({**DEFAULT_LOCATION, "warning": warning_msg}), 503 # 503 Service Unavailable
+        return ojsonify({**DEFAULT_LOCATION, "warning": warning_msg}), 503 # 503 Service Unavailable
 
 if __name__ == '__main__':
     # Run on port 5001. debug=True reloads on code changes.
@@ -1,7 +1,13 @@
+import logging
+import functools
+import math
 import os
-import random
-from flask import Flask, request, jsonify
-from geopy.distance import geodesic # Import geodesic distance calculation
+from collections import namedtuple
+from operator import itemgetter
+import numpy as np
+import orjson
+from numba import njit
+from flask import Flask, request, Response
 
 app = Flask(__name__)
 
@@ -10,6 +16,122 @@ app = Flask(__name__)
 CLOUD_SOURCE = os.getenv('CLOUD_PROVIDER', 'GCP')
 PORT_TO_USE = int(os.getenv('PORT', 5002)) # Allow port override via env var
 
+# Per-request messages are logged at DEBUG, so they are skipped entirely at the default WARNING level.
+# Set LOG_LEVEL=DEBUG to see them during development.
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'WARNING').upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088 # Mean Earth radius
+
+# Preferences are passed to the compiled kernel as small ints
+FASTEST, CHEAPEST, GREENEST = 0, 1, 2
+PREFERENCE_CODES = {"fastest": FASTEST, "cheapest": CHEAPEST, "greenest": GREENEST}
+
+# Shared random generator for all mock data (PCG64)
+RNG = np.random.default_rng()
+
+# Per-mode parameters: one table row per mode replaces per-mode if/elif branches.
+# Rough average speed assumptions (km/h) and emission ranges (g CO2/km) - ADJUST THESE AS NEEDED!
+# speed_per_km/min_speed/max_speed let trains speed up over long distances (slower short hops incl. station time).
+ModeParams = namedtuple("ModeParams", "speed speed_jitter speed_per_km min_speed max_speed em_lo em_hi has_cost")
+MODE_PARAMS = {
+    "car": ModeParams(70, 10, 0, 0, math.inf, 100, 200, True),
+    "bus": ModeParams(40, 5, 0, 0, math.inf, 30, 80, True), # Per passenger emissions estimate
+    "train": ModeParams(50, 15, 0.05, 30, 120, 10, 50, True),
+    "bicycle": ModeParams(15, 3, 0, 0, math.inf, 0, 0, False),
+    "walking": ModeParams(5, 0.5, 0, 0, math.inf, 0, 0, False),
+    "scooter": ModeParams(12, 2, 0, 0, math.inf, 5, 20, True),
+}
+
+# The same table as one contiguous structured array indexed by mode, so each mode's
+# parameters are a single record (one memory access) inside the compiled kernel
+MODE_NAMES = np.array(list(MODE_PARAMS))
+MODE_DTYPE = np.dtype([(field, "?" if field == "has_cost" else "f8") for field in ModeParams._fields])
+MODE_TABLE = np.array([tuple(params) for params in MODE_PARAMS.values()], dtype=MODE_DTYPE)
+
+def mode_indices(*modes):
+    """Returns the table indices for the given mode names."""
+    return np.flatnonzero(np.isin(MODE_NAMES, modes))
+
+# Mode indices offered for a given trip length
+ALL_MODES = np.arange(len(MODE_NAMES))
+MEDIUM_DISTANCE_MODES = mode_indices("car", "bus", "train", "bicycle", "scooter") # No walking
+LONG_DISTANCE_MODES = mode_indices("car", "bus", "train")
+
+def ojsonify(obj, status=200):
+    """Drop-in replacement for jsonify that serializes with orjson."""
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+def valid_coordinate(value, limit):
+    """True for a parsed, finite coordinate within [-limit, limit] (90 for latitude, 180 for longitude)."""
+    return value is not None and math.isfinite(value) and -limit <= value <= limit
+
+def haversine_km(o_lat, o_lon, d_lat, d_lon):
+    """Great-circle distance in km (closed form, within ~0.5% of the ellipsoidal geodesic)."""
+    phi1, phi2 = math.radians(o_lat), math.radians(d_lat)
+    dphi = phi2 - phi1
+    dlam = math.radians(d_lon - o_lon)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlam / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a))) # Clamp rounding error near antipodes
+
+@functools.lru_cache(maxsize=1024)
+def cached_distance_km(o_lat_q, o_lon_q, d_lat_q, d_lon_q):
+    """Memoized haversine_km for coordinates already quantized with round(x, 3) (~100 m)."""
+    return haversine_km(o_lat_q, o_lon_q, d_lat_q, d_lon_q)
+
+# Number of U[0, 1) draws compute_options consumes per option
+N_UNIFORMS = 8
+
+@njit(cache=True)
+def compute_options(distance_km, mode_idx, preference_code, uniforms):
+    """
+    Numeric core of get_recommendations, compiled to native code with Numba.
+    Returns response-ready (durations, costs, emissions) arrays for the selected mode indices:
+    whole minutes, and cost/emissions rounded to 2 decimals.
+    uniforms is a (len(mode_idx), N_UNIFORMS) array of U[0, 1) draws supplied by the caller.
+    """
+    num_options = mode_idx.shape[0]
+    durations = np.empty(num_options, dtype=np.int64)
+    costs = np.empty(num_options)
+    emissions = np.empty(num_options)
+    cost_factor = 0.01 + (distance_km * 0.0005) # Small base + per km factor
+
+    for i in range(num_options):
+        mode = MODE_TABLE[mode_idx[i]]
+        u = uniforms[i]
+
+        # --- Estimate Duration based on Distance & Mode ---
+        avg_speed_kph = mode["speed"] + mode["speed_per_km"] * distance_km + (2 * u[0] - 1) * mode["speed_jitter"] # Add slight speed variance
+        avg_speed_kph = min(max(avg_speed_kph, mode["min_speed"]), mode["max_speed"]) # Cap speed range
+        # Add randomness *around* the estimate (+/- 30%) and ensure a minimum duration of 5 mins
+        base_duration = max(5.0, distance_km / avg_speed_kph * 60 * (0.7 + 0.6 * u[1]))
+
+        # --- Simulate Cost and Emissions ---
+        base_cost = 0.0 # Bicycle/walking are free
+        if mode["has_cost"]:
+            base_cost = round(max(0.5, (0.5 + u[2]) * base_duration * cost_factor), 2) # Min cost $0.50 if not free
+        emissions_factor_g_km = mode["em_lo"] + (mode["em_hi"] - mode["em_lo"]) * u[3]
+        base_emissions_kg = round(max(0.0, distance_km * emissions_factor_g_km / 1000 * (0.8 + 0.4 * u[4])), 2)
+
+        # --- Adjust based on user preference ---
+        durations[i] = int(base_duration * (0.85 if preference_code == FASTEST else 1.0 + 0.15 * u[5])) # Integer minutes
+        final_cost = base_cost * (0.80 if preference_code == CHEAPEST else 1.0 + 0.2 * u[6])
+        costs[i] = round(max(0.5, final_cost), 2) if base_cost > 0 else 0.0
+        emissions[i] = round(max(0.0, base_emissions_kg * (0.70 if preference_code == GREENEST else 1.0 + 0.3 * u[7])), 2)
+
+    return durations, costs, emissions
+
+# Compile (or load from cache) at startup so the first real request doesn't pay the JIT cost
+compute_options(1.0, ALL_MODES[:1], FASTEST, np.zeros((1, N_UNIFORMS)))
+
+# Each request draws all of its randomness in one RNG call, laid out as:
+# [option count | one shuffle key per mode | compute_options draws | option id suffixes]
+MAX_OPTIONS = 4
+MODE_KEYS_START = 1
+KERNEL_UNIFORMS_START = MODE_KEYS_START + len(MODE_NAMES)
+ID_SUFFIXES_START = KERNEL_UNIFORMS_START + MAX_OPTIONS * N_UNIFORMS
+UNIFORMS_PER_REQUEST = ID_SUFFIXES_START + MAX_OPTIONS
+
 @app.route('/recommendations', methods=['GET'])
 def get_recommendations():
     """
@@ -17,138 +139,97 @@ def get_recommendations():
     Takes origin/destination coordinates and preference as input.
     Simulates data coming from a specific cloud provider (GCP/Azure).
     """
-    origin_lat = request.args.get('origin_lat')
-    origin_lon = request.args.get('origin_lon')
-    dest_lat = request.args.get('dest_lat')
-    dest_lon = request.args.get('dest_lon')
-    preference = request.args.get('preference', 'fastest') # fastest, cheapest, greenest
-
-    if not all([origin_lat, origin_lon, dest_lat, dest_lon]):
-        return jsonify({"error": "Missing origin or destination coordinates"}), 400
-
-    print(f"Routing Service ({CLOUD_SOURCE}): Received request from ({origin_lat},{origin_lon}) to ({dest_lat},{dest_lon}), preference: {preference}")
+    # Werkzeug parses each coordinate once; a missing or non-numeric value comes back as None,
+    # and 'nan'/'inf' or out-of-range values are rejected by valid_coordinate below
+    origin_lat = request.args.get('origin_lat', type=float)
+    origin_lon = request.args.get('origin_lon', type=float)
+    dest_lat = request.args.get('dest_lat', type=float)
+    dest_lon = request.args.get('dest_lon', type=float)
+    preference = request.args.get('preference', 'fastest')
+
+    if not (valid_coordinate(origin_lat, 90) and valid_coordinate(origin_lon, 180)
+            and valid_coordinate(dest_lat, 90) and valid_coordinate(dest_lon, 180)):
+        return ojsonify({"error": "Missing or invalid coordinates"}), 400
+    if preference not in PREFERENCE_CODES:
+        return ojsonify({"error": f"Invalid preference '{preference}'. Use one of: fastest, cheapest, greenest"}), 400
+
+    logger.debug("Routing Service (%s): Received request from (%s,%s) to (%s,%s), preference: %s", CLOUD_SOURCE, origin_lat, origin_lon, dest_lat, dest_lon, preference)
 
     # --- Calculate Distance ---
     try:
-        origin_point = (float(origin_lat), float(origin_lon))
-        dest_point = (float(dest_lat), float(dest_lon))
-        # Calculate the distance using geodesic which is accurate on an ellipsoid (Earth)
-        distance_km = geodesic(origin_point, dest_point).km
-        print(f"Routing Service ({CLOUD_SOURCE}): Calculated distance: {distance_km:.2f} km")
-    except ValueError:
-        print(f"Error: Invalid coordinate format received: lat={origin_lat}, lon={origin_lon} / lat={dest_lat}, lon={dest_lon}")
-        return jsonify({"error": "Invalid coordinate format"}), 400
+        # Haversine is plenty accurate for city-to-city estimates and much cheaper than geodesic.
+        # Requests mostly repeat the same few city pairs, so quantize and reuse cached distances.
+        distance_km = cached_distance_km(round(origin_lat, 3), round(origin_lon, 3), round(dest_lat, 3), round(dest_lon, 3))
+        logger.debug("Routing Service (%s): Calculated distance: %.2f km", CLOUD_SOURCE, distance_km)
     except Exception as e:
         # Catch potential errors during distance calculation
-        print(f"Error calculating distance: {e}")
-        return jsonify({"error": "Could not calculate distance"}), 500
+        logger.error("Error calculating distance: %s", e)
+        return ojsonify({"error": "Could not calculate distance"}), 500
 
     # --- MOCK DATA GENERATION (Distance-Aware) ---
-    options = []
-    possible_modes = ["car", "bus", "train", "bicycle", "walking", "scooter"]
     # Don't offer walking/bicycle for very long distances
     if distance_km > 200:
-        possible_modes = ["car", "bus", "train"]
+        possible_modes = LONG_DISTANCE_MODES
     elif distance_km > 50:
-        possible_modes = ["car", "bus", "train", "bicycle", "scooter"]
-
-    num_options = random.randint(1, min(len(possible_modes), 4)) # Generate 1 to 4 options
-    selected_modes = random.sample(possible_modes, num_options) if possible_modes else []
-
-    for i, mode in enumerate(selected_modes):
-
-        # --- Estimate Duration based on Distance & Mode ---
-        # Rough average speed assumptions (km/h) - ADJUST THESE AS NEEDED!
-        avg_speed_kph = 50 # Default/fallback
-        if mode == "car":
-            avg_speed_kph = 70 + random.uniform(-10, 10) # Add slight speed variance
-        elif mode == "train":
-             # Trains are faster over long distances, slower for short hops (incl. station time)
-            avg_speed_kph = 50 + (distance_km * 0.05) + random.uniform(-15, 15)
-            avg_speed_kph = max(30, min(avg_speed_kph, 120)) # Cap speed range
-        elif mode == "bus":
-            avg_speed_kph = 40 + random.uniform(-5, 5)
-        elif mode == "bicycle":
-            avg_speed_kph = 15 + random.uniform(-3, 3)
-        elif mode == "walking":
-            avg_speed_kph = 5 + random.uniform(-0.5, 0.5)
-        elif mode == "scooter":
-             avg_speed_kph = 12 + random.uniform(-2, 2)
-
-        # Calculate estimated base duration in hours, then minutes
-        if avg_speed_kph <= 0:
-             estimated_minutes = float('inf') # Avoid division by zero
-        else:
-             estimated_hours = distance_km / avg_speed_kph
-             estimated_minutes = estimated_hours * 60
-
-        # Add randomness *around* the estimate (e.g., +/- 30%)
-        # Make randomness factor smaller for very short distances?
-        random_factor = random.uniform(0.7, 1.3)
-        base_duration = estimated_minutes * random_factor
-
-        # Ensure minimum duration (e.g., 5 mins) and handle infinite case
-        if base_duration == float('inf'):
-             base_duration = 99999 # Assign a very large number if speed was 0
-        base_duration = max(5, base_duration)
-
-        # --- Simulate Cost and Emissions (Still basic, could be distance-based) ---
-        # Example: Make cost slightly distance dependent
-        cost_factor = 0.01 + (distance_km * 0.0005) # Small base + per km factor
-        base_cost = (random.uniform(0.5, 1.5) * base_duration * cost_factor) if mode not in ["bicycle", "walking"] else 0
-        base_cost = round(max(0.5, base_cost), 2) if base_cost > 0 else 0 # Min cost $0.50 if not free
-
-        # Example: Make emissions slightly distance dependent (grams CO2 per km)
-        emissions_factor_g_km = 0
-        if mode == "car": emissions_factor_g_km = random.uniform(100, 200)
-        elif mode == "bus": emissions_factor_g_km = random.uniform(30, 80) # Per passenger estimate is lower
-        elif mode == "train": emissions_factor_g_km = random.uniform(10, 50)
-        elif mode == "scooter": emissions_factor_g_km = random.uniform(5, 20)
-
-        base_emissions_kg = (distance_km * emissions_factor_g_km / 1000) * random.uniform(0.8, 1.2)
-        base_emissions_kg = round(max(0, base_emissions_kg), 2)
-
-
-        # --- Adjust based on user preference ---
-        final_duration = base_duration * (0.85 if preference == 'fastest' else random.uniform(1.0, 1.15))
-        final_cost = base_cost * (0.80 if preference == 'cheapest' else random.uniform(1.0, 1.2))
-        # Ensure cost doesn't become negative if base was 0
-        final_cost = max(0, final_cost) if base_cost == 0 else max(0.5, final_cost)
-
-        final_emissions = base_emissions_kg * (0.70 if preference == 'greenest' else random.uniform(1.0, 1.3))
-        final_emissions = max(0, final_emissions)
-
-
-        options.append({
-            "id": f"{mode}-{i+1}-{CLOUD_SOURCE}-{random.randint(100,999)}",
+        possible_modes = MEDIUM_DISTANCE_MODES
+    else:
+        possible_modes = ALL_MODES
+
+    u = RNG.random(UNIFORMS_PER_REQUEST)
+    num_options = 1 + int(u[0] * min(len(possible_modes), MAX_OPTIONS)) # Generate 1 to 4 options
+    # Sorting i.i.d. uniform keys gives a random permutation, so this samples modes without replacement
+    mode_keys = u[MODE_KEYS_START:MODE_KEYS_START + len(possible_modes)]
+    mode_idx = possible_modes[np.argsort(mode_keys)[:num_options]]
+    kernel_uniforms = u[KERNEL_UNIFORMS_START:KERNEL_UNIFORMS_START + num_options * N_UNIFORMS].reshape(num_options, N_UNIFORMS)
+    final_duration, final_cost, final_emissions = compute_options(
+        distance_km, mode_idx, PREFERENCE_CODES[preference], kernel_uniforms
+    )
+
+    # Build each option dict once, straight from the kernel's arrays (one .tolist() per array)
+    id_suffixes = (100 + u[ID_SUFFIXES_START:ID_SUFFIXES_START + num_options] * 900).astype(int)
+    rounded_distance_km = round(distance_km, 1) # Include distance
+    options = [
+        {
+            "id": f"{mode}-{i+1}-{CLOUD_SOURCE}-{suffix}",
             "mode": mode,
-            "duration_minutes": int(final_duration), # Convert to integer minutes
-            "cost_usd": round(final_cost, 2),
-            "environmental_impact_co2_kg": round(final_emissions, 2),
-            "estimated_distance_km": round(distance_km, 1), # Include distance
+            "duration_minutes": duration,
+            "cost_usd": cost,
+            "environmental_impact_co2_kg": emissions,
+            "estimated_distance_km": rounded_distance_km,
             "source_cloud": CLOUD_SOURCE
-        })
+        }
+        for i, (mode, duration, cost, emissions, suffix) in enumerate(zip(
+            MODE_NAMES[mode_idx].tolist(),
+            final_duration.tolist(),
+            final_cost.tolist(),
+            final_emissions.tolist(),
+            id_suffixes.tolist()
+        ))
+    ]
 
     # Sort results based on preference
     if preference == 'fastest':
-        options.sort(key=lambda x: x['duration_minutes'])
+        options.sort(key=itemgetter('duration_minutes'))
     elif preference == 'cheapest':
         # Sort primarily by cost, secondarily by duration
-        options.sort(key=lambda x: (x['cost_usd'], x['duration_minutes']))
+        options.sort(key=itemgetter('cost_usd', 'duration_minutes'))
     elif preference == 'greenest':
         # Prioritize zero emission, then lowest emission, then time
-        options.sort(key=lambda x: (x['environmental_impact_co2_kg'] > 0, x['environmental_impact_co2_kg'], x['duration_minutes']))
+        # (emissions are never negative, so zero-emission options already sort first)
+        options.sort(key=itemgetter('environmental_impact_co2_kg', 'duration_minutes'))
 
-    print(f"Routing Service ({CLOUD_SOURCE}): Returning {len(options)} recommendations.")
-    return jsonify({"recommendations": options})
+    logger.debug("Routing Service (%s): Returning %d recommendations.", CLOUD_SOURCE, len(options))
+    # The API Gateway splices this body into its response as-is, so keep "recommendations" the only key
+    return ojsonify({"recommendations": options})
 
 # Simple health check endpoint
 @app.route('/health', methods=['GET'])
 def health_check():
     """Basic health check endpoint."""
-    return jsonify({"status": "ok", "source": CLOUD_SOURCE}), 200
+    return ojsonify({"status": "ok", "source": CLOUD_SOURCE}), 200
 
 if __name__ == '__main__':
     print(f"Starting Routing Service ({CLOUD_SOURCE}) on http://127.0.0.1:{PORT_TO_USE}")
     # Use host='0.0.0.0' to make it accessible on your network if needed
-    app.run(host='0.0.0.0', port=PORT_TO_USE, debug=True) # Keep debug=True for development
\ No newline at end of file
+    # Debug mode is off: the reloader and per-request access logging slow every request down
+    app.run(host='0.0.0.0', port=PORT_TO_USE)
\ No newline at end of file